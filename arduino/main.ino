@@ -5,82 +5,392 @@
 Adafruit_INA219 ina219;
 LiquidCrystal_I2C lcd(0x27, 20, 4); // 20 colonnes, 4 lignes
 
+#define INA219_ADDR 0x40
+#define INA219_REG_CONFIG 0x00
+
 float shuntvoltage = 0;
 float busvoltage = 0;
 float current_mA = 0;
 float loadvoltage = 0;
 float power_mW = 0;
+unsigned long sampleMicros = 0;
 
-void setup() {
-  Serial.begin(9600);
-  
-  // Initialisation du capteur avec calibration optimisée pour faibles courants
-  if (!ina219.begin()) {
-    Serial.println("INA219 non detecte");
-    while (1) { delay(10); }
+// Mesure complète telle qu'envoyée à l'hôte
+struct Sample {
+  float loadvoltage;
+  float current_mA;
+  float power_mW;
+  float busvoltage;
+  float shuntvoltage;
+  unsigned long micros;
+};
+
+// Configuration pilotable depuis l'hôte (voir handleCommand)
+unsigned long samplePeriod = 1000;  // Période d'échantillonnage (ms)
+unsigned long lcdPeriod = 1000;     // Période de rafraîchissement LCD (ms), 0 = désactivé
+uint8_t adcCode = 0x3;              // Code ADC INA219 (0x3 = 12 bits, 1 échantillon)
+
+// Mode adaptatif : période courte pendant les transitoires, longue au repos
+bool adaptive = false;
+unsigned long minPeriod = 50;
+unsigned long maxPeriod = 2000;
+float adaptiveThreshold = 5.0;      // Variation de courant (mA) considérée comme transitoire
+float lastCurrent = 0;
+unsigned long lastSent = 0;
+// Extrêmes de courant depuis la dernière ligne envoyée (7e et 8e champs)
+float peakMin = 1e9;
+float peakMax = -1e9;
+// Dernière mesure lue, renvoyée avant un transitoire si elle n'a pas été envoyée
+Sample previous;
+bool hasPrevious = false;
+bool previousSent = false;
+
+// Mode agrégation : échantillonnage continu, intégration sur l'appareil et
+// envoi d'un résumé par intervalle au lieu des mesures brutes
+unsigned long aggPeriod = 0;        // Intervalle d'agrégation (ms), 0 = désactivé
+unsigned long aggStart = 0;
+unsigned long aggLastMicros = 0;
+unsigned long aggElapsedMicros = 0;
+unsigned long aggCount = 0;
+float aggSum[3];
+float aggMin[3];
+float aggMax[3];
+float aggPrevCurrent = 0;
+float aggPrevPower = 0;
+float aggCharge_mAh = 0;
+float aggEnergy_mWh = 0;
+
+unsigned long lastSample = 0;
+unsigned long lastLcd = 0;
+String command = "";
+
+// Réécrit les bits BADC/SADC du registre de configuration
+// (les fonctions setCalibration_* remettent la configuration par défaut)
+void applyAdc() {
+  Wire.beginTransmission(INA219_ADDR);
+  Wire.write(INA219_REG_CONFIG);
+  Wire.endTransmission();
+  Wire.requestFrom(INA219_ADDR, 2);
+  uint16_t config = ((uint16_t)Wire.read() << 8) | Wire.read();
+  config &= ~0x07F8;
+  config |= ((uint16_t)adcCode << 7) | ((uint16_t)adcCode << 3);
+  Wire.beginTransmission(INA219_ADDR);
+  Wire.write(INA219_REG_CONFIG);
+  Wire.write((config >> 8) & 0xFF);
+  Wire.write(config & 0xFF);
+  Wire.endTransmission();
+}
+
+// Nombre d'échantillons moyennés -> code ADC (12 bits)
+bool averagingCode(long samples, uint8_t *code) {
+  switch (samples) {
+    case 1:   *code = 0x3; return true;
+    case 2:   *code = 0x9; return true;
+    case 4:   *code = 0xA; return true;
+    case 8:   *code = 0xB; return true;
+    case 16:  *code = 0xC; return true;
+    case 32:  *code = 0xD; return true;
+    case 64:  *code = 0xE; return true;
+    case 128: *code = 0xF; return true;
   }
-  
-  // Configuration pour une meilleure précision avec les faibles courants
-  // Choisissez l'une des options suivantes selon votre application:
-  
-  // Option 1: Pour courants jusqu'à 1A (précision pour faibles courants)
-  ina219.setCalibration_32V_1A();
-  
-  // Option 2: Pour courants jusqu'à 320mA (plus précis pour très faibles courants)
-  // ina219.setCalibration_32V_320mA();
-  
-  // Option 3: Pour courants jusqu'à 100mA (très haute précision pour micro-courants)
-  // ina219.setCalibration_16V_100mA();
-  
-  lcd.init();
-  lcd.backlight();
-  lcd.clear();
-  lcd.setCursor(0, 0);
-  lcd.print("INA219 Calibre");
-  lcd.setCursor(0, 1);
-  lcd.print("Mode: 1A");
-  delay(2000);
+  return false;
 }
 
-void loop() {
-  // Lecture des données avec calibration
+// Commandes reçues de l'hôte, une par ligne :
+//   CAL 1A|320MA|100MA     plage de calibration
+//   AVG n                  moyennage ADC (1, 2, 4 ... 128 échantillons)
+//   PERIOD ms              période d'échantillonnage
+//   LCD ms                 période de rafraîchissement LCD (0 = désactivé)
+//   ADAPT min max seuil    mode adaptatif (ADAPT OFF pour le désactiver)
+//   AGG ms                 mode agrégation sur l'intervalle donné (0 = désactivé)
+// Réponse : "OK <commande>" ou "ERR <commande>"
+void handleCommand(String cmd) {
+  cmd.trim();
+  cmd.toUpperCase();
+  bool ok = true;
+
+  if (cmd == "CAL 1A") {
+    ina219.setCalibration_32V_1A();
+    applyAdc();
+  } else if (cmd == "CAL 320MA") {
+    ina219.setCalibration_32V_320mA();
+    applyAdc();
+  } else if (cmd == "CAL 100MA") {
+    ina219.setCalibration_16V_100mA();
+    applyAdc();
+  } else if (cmd.startsWith("AVG ")) {
+    ok = averagingCode(cmd.substring(4).toInt(), &adcCode);
+    if (ok) applyAdc();
+  } else if (cmd.startsWith("PERIOD ")) {
+    long value = cmd.substring(7).toInt();
+    ok = value > 0;
+    if (ok) samplePeriod = value;
+  } else if (cmd.startsWith("LCD ")) {
+    long value = cmd.substring(4).toInt();
+    ok = value >= 0;
+    if (ok) lcdPeriod = value;
+  } else if (cmd == "ADAPT OFF") {
+    adaptive = false;
+  } else if (cmd.startsWith("ADAPT ")) {
+    String args = cmd.substring(6);
+    int first = args.indexOf(' ');
+    int second = args.indexOf(' ', first + 1);
+    long lo = args.substring(0, first).toInt();
+    long hi = args.substring(first + 1, second).toInt();
+    float threshold = args.substring(second + 1).toFloat();
+    ok = first > 0 && second > first && lo > 0 && hi >= lo && threshold > 0;
+    if (ok) {
+      minPeriod = lo;
+      maxPeriod = hi;
+      adaptiveThreshold = threshold;
+      samplePeriod = minPeriod;
+      adaptive = true;
+    }
+  } else if (cmd.startsWith("AGG ")) {
+    long value = cmd.substring(4).toInt();
+    ok = value >= 0;
+    if (ok) {
+      aggPeriod = value;
+      resetAggregate();
+      aggLastMicros = 0;
+    }
+  } else {
+    ok = false;
+  }
+
+  Serial.print(ok ? "OK " : "ERR ");
+  Serial.println(cmd);
+}
+
+void resetAggregate() {
+  aggStart = millis();
+  aggElapsedMicros = 0;
+  aggCount = 0;
+  aggCharge_mAh = 0;
+  aggEnergy_mWh = 0;
+  for (int i = 0; i < 3; i++) {
+    aggSum[i] = 0;
+    aggMin[i] = 1e9;
+    aggMax[i] = -1e9;
+  }
+}
+
+void readSensor() {
+  sampleMicros = micros();
   shuntvoltage = ina219.getShuntVoltage_mV();
   busvoltage = ina219.getBusVoltage_V();
   current_mA = ina219.getCurrent_mA();
   power_mW = ina219.getPower_mW();
   loadvoltage = busvoltage + (shuntvoltage / 1000.0);
-  
+}
+
+// Intègre une mesure (trapèzes sur micros()) dans l'intervalle courant
+void accumulateSample() {
+  unsigned long nowMicros = micros();
+  if (aggLastMicros != 0) {
+    unsigned long dt = nowMicros - aggLastMicros;  // sans effet du débordement
+    aggElapsedMicros += dt;
+    aggCharge_mAh += (aggPrevCurrent + current_mA) / 2.0 * (dt / 3.6e9);
+    aggEnergy_mWh += (aggPrevPower + power_mW) / 2.0 * (dt / 3.6e9);
+  }
+  aggLastMicros = nowMicros;
+  aggPrevCurrent = current_mA;
+  aggPrevPower = power_mW;
+
+  float values[3] = {loadvoltage, current_mA, power_mW};
+  for (int i = 0; i < 3; i++) {
+    aggSum[i] += values[i];
+    aggMin[i] = min(aggMin[i], values[i]);
+    aggMax[i] = max(aggMax[i], values[i]);
+  }
+  aggCount++;
+}
+
+// AGG,durée_ms,n,V moy,V min,V max,mA moy,mA min,mA max,mW moy,mW min,mW max,mAh,mWh
+void sendAggregate() {
+  Serial.print("AGG,");
+  Serial.print(aggElapsedMicros / 1000.0, 3);
+  Serial.print(",");
+  Serial.print(aggCount);
+  for (int i = 0; i < 3; i++) {
+    Serial.print(",");
+    Serial.print(aggSum[i] / aggCount, 3);
+    Serial.print(",");
+    Serial.print(aggMin[i], 3);
+    Serial.print(",");
+    Serial.print(aggMax[i], 3);
+  }
+  Serial.print(",");
+  Serial.print(aggCharge_mAh, 6);
+  Serial.print(",");
+  Serial.println(aggEnergy_mWh, 6);
+}
+
+void readCommands() {
+  while (Serial.available()) {
+    char c = Serial.read();
+    if (c == '\n') {
+      handleCommand(command);
+      command = "";
+    } else if (c != '\r' && command.length() < 32) {
+      command += c;
+    }
+  }
+}
+
+void updateLcd() {
   lcd.clear();
-  
+
   // Affichage détaillé pour le débogage
   lcd.setCursor(0, 0);
   lcd.print("U:");
   lcd.print(loadvoltage, 2);   // Tension de charge avec 2 décimales
   lcd.print("V I:");
   lcd.print(current_mA, 1);   // Courant avec 1 décimale
-  
+
   lcd.setCursor(0, 1);
   lcd.print("P:");
   lcd.print(power_mW, 1);     // Puissance avec 1 décimale
   lcd.print("mW S:");
   lcd.print(shuntvoltage, 2); // Tension de shunt avec 2 décimales
-  
+
   // Affichage des tensions pour diagnostic
   lcd.setCursor(0, 2);
   lcd.print("Bus:");
   lcd.print(busvoltage, 2);
   lcd.print("V");
-  
-  // Envoi des données complètes pour analyse
-  Serial.print(loadvoltage, 3);
+
+  lcd.setCursor(0, 3);
+  lcd.print("T:");
+  lcd.print(samplePeriod);
+  lcd.print("ms");
+  if (adaptive) lcd.print(" auto");
+}
+
+// Envoi d'une mesure complète pour analyse
+// (6e champ : horodatage micros() de l'appareil pour l'intégration côté hôte,
+//  7e et 8e : courant min/max lu depuis la ligne précédente)
+void sendSample(const Sample &sample) {
+  Serial.print(sample.loadvoltage, 3);
+  Serial.print(",");
+  Serial.print(sample.current_mA, 3);
+  Serial.print(",");
+  Serial.print(sample.power_mW, 3);
   Serial.print(",");
-  Serial.print(current_mA, 3);
+  Serial.print(sample.busvoltage, 3);
   Serial.print(",");
-  Serial.print(power_mW, 3);
+  Serial.print(sample.shuntvoltage, 3);
   Serial.print(",");
-  Serial.print(busvoltage, 3);
+  Serial.print(sample.micros);
   Serial.print(",");
-  Serial.println(shuntvoltage, 3);
-  
-  delay(1000);  // Délai de 1 seconde entre les mesures
-}
\ No newline at end of file
+  Serial.print(peakMin, 3);
+  Serial.print(",");
+  Serial.println(peakMax, 3);
+  peakMin = 1e9;
+  peakMax = -1e9;
+}
+
+void setup() {
+  // 115200 bauds : une ligne complète (~61 octets) part en ~5 ms, ce qui
+  // laisse le temps de lire le capteur à chaque minPeriod en mode adaptatif
+  Serial.begin(115200);
+
+  // Initialisation du capteur avec calibration optimisée pour faibles courants
+  if (!ina219.begin()) {
+    Serial.println("INA219 non detecte");
+    while (1) { delay(10); }
+  }
+
+  // Configuration pour une meilleure précision avec les faibles courants
+  // Calibration par défaut, modifiable depuis l'hôte avec la commande CAL :
+
+  // Option 1: Pour courants jusqu'à 1A (précision pour faibles courants)  -> CAL 1A
+  ina219.setCalibration_32V_1A();
+
+  // Option 2: Pour courants jusqu'à 320mA (plus précis pour très faibles courants)  -> CAL 320MA
+  // ina219.setCalibration_32V_320mA();
+
+  // Option 3: Pour courants jusqu'à 100mA (très haute précision pour micro-courants)  -> CAL 100MA
+  // ina219.setCalibration_16V_100mA();
+
+  lcd.init();
+  lcd.backlight();
+  lcd.clear();
+  lcd.setCursor(0, 0);
+  lcd.print("INA219 Calibre");
+  lcd.setCursor(0, 1);
+  lcd.print("Mode: 1A");
+  delay(2000);
+
+  // Signale à l'hôte que les commandes peuvent être envoyées
+  Serial.println("READY");
+}
+
+void loop() {
+  readCommands();
+
+  unsigned long now = millis();
+
+  // Mode agrégation : lecture aussi rapide que le bus I2C le permet
+  if (aggPeriod > 0) {
+    readSensor();
+    accumulateSample();
+    if (now - aggStart >= aggPeriod && aggCount > 0) {
+      sendAggregate();
+      resetAggregate();
+    }
+    if (lcdPeriod > 0 && now - lastLcd >= lcdPeriod) {
+      lastLcd = now;
+      updateLcd();
+    }
+    return;
+  }
+
+  // En mode adaptatif le capteur est lu à chaque minPeriod ; samplePeriod
+  // ne fixe que le rythme d'envoi vers l'hôte
+  unsigned long readPeriod = adaptive ? minPeriod : samplePeriod;
+  if (now - lastSample < readPeriod) {
+    return;
+  }
+  lastSample = now;
+
+  // Lecture des données avec calibration
+  readSensor();
+  Sample current = {
+    loadvoltage, current_mA, power_mW, busvoltage, shuntvoltage, sampleMicros
+  };
+
+  // Mode adaptatif : envoi immédiat sur transitoire, espacé progressivement au repos
+  bool send = true;
+  if (adaptive) {
+    if (fabs(current_mA - lastCurrent) > adaptiveThreshold) {
+      // La dernière mesure stable part d'abord, pour que l'hôte n'intègre pas
+      // le pic sur tout l'intervalle depuis la ligne précédente
+      if (hasPrevious && !previousSent) {
+        sendSample(previous);
+      }
+      samplePeriod = minPeriod;
+    } else if (now - lastSent >= samplePeriod) {
+      samplePeriod = min(samplePeriod * 2, maxPeriod);
+    } else {
+      send = false;
+    }
+  }
+  lastCurrent = current_mA;
+  peakMin = min(peakMin, current_mA);
+  peakMax = max(peakMax, current_mA);
+  previous = current;
+  hasPrevious = true;
+  previousSent = send;
+
+  if (lcdPeriod > 0 && now - lastLcd >= lcdPeriod) {
+    lastLcd = now;
+    updateLcd();
+  }
+
+  if (!send) {
+    return;
+  }
+  lastSent = now;
+  sendSample(current);
+}
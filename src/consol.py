@@ -1,4 +1,6 @@
 import csv
+import json
+import os
 import time
 from datetime import datetime
 
@@ -9,11 +11,14 @@ from filterpy.kalman import KalmanFilter
 
 
 class ConsoLogger:
+    # Plancher de R par canal : carré du pas de quantification de l'INA219
+    # (calibration 32V_1A : 4 mV bus, 0,04 mA courant, 0,8 mW puissance)
+    KALMAN_R_FLOOR = {"voltage": 0.004**2, "current": 0.04**2, "power": 0.8**2}
 
     def __init__(
         self,
         port="COM12",
-        baudrate=9600,
+        baudrate=115200,
         duration=60,
         csv_file="./data/donnees_conso.csv",
         img_file="./data/courbes_conso.png",
@@ -23,6 +28,12 @@ class ConsoLogger:
         voltage_max=5.08,
         voltage_min=5.0,
         current_max=1000,
+        kalman_params=None,
+        index_block_size=1000,
+        device_config=None,
+        integration="rectangle",
+        max_gap_s=5.0,
+        integration_batch=256,
     ):
         self.voltage_min = voltage_min
         self.voltage_max = voltage_max
@@ -35,6 +46,25 @@ class ConsoLogger:
         self.battery_voltage = battery_voltage
         self.safety_margin = safety_margin
         self.target_days = target_days
+        self.index_block_size = index_block_size
+        # Configuration envoyée au firmware à l'ouverture du port, ex. :
+        # {"calibration": "320mA", "averaging": 8, "period_ms": 200,
+        #  "lcd_ms": 2000, "adaptive": (50, 2000, 5.0), "aggregate_ms": 1000}
+        self.device_config = device_config or {}
+        # "rectangle" : horodatage datetime.now() de l'hôte (historique)
+        # "trapezoid" : horodatage micros() de l'appareil, sinon monotonic_ns(),
+        #               intégration par trapèzes et par lots, trous signalés
+        self.integration = integration
+        self.max_gap_s = max_gap_s
+        self.integration_batch = integration_batch
+        self.ticks_ns = []
+        self.gaps = []
+        self.integrated_duration_s = 0
+        self._tick_source = None
+        self._last_micros = None
+        self._last_host_ns = None
+        self._micros_offset = 0
+        self._integrated_upto = 0
         self.timestamps = []
         self.voltages = []
         self.currents = []
@@ -42,40 +72,195 @@ class ConsoLogger:
         self.voltages_kalman = []
         self.currents_kalman = []
         self.powers_kalman = []
+        self.bus_voltages = []
+        self.shunt_voltages = []
+        # Courant min/max lu par le firmware entre deux lignes (mode adaptatif)
+        self.current_peaks = []
         self.total_energy_mWh_raw = 0
         self.total_charge_mAh_raw = 0
         self.total_energy_mWh_filtered = 0
         self.total_charge_mAh_filtered = 0
+        # Résumés par intervalle intégrés par le firmware (mode AGG)
+        self.aggregates = []
+        self.device_duration_s = 0
         self.stats = {}
+        self._report = None
+        self._report_key = None
+        # Tampon numpy (puissance, courant, tension, puis versions Kalman)
+        # alimenté pendant l'acquisition et lu par compute_report()
+        self._series = np.empty((6, 0))
+        self._series_len = 0
+        self._series_stats = None
+        self._series_stats_len = None
+        # Paramètres (q, r) par canal, issus de auto_tune_kalman() ou fournis
+        self.kalman_params = kalman_params or {}
         self.setup_kalman_filter()
 
     def setup_kalman_filter(self):
-        def create_filter():
+        def create_filter(name):
+            q, r = self.kalman_params.get(name, (0.001, 10))
             kf = KalmanFilter(dim_x=2, dim_z=1)
             kf.x = np.array([[0.0], [0.0]])
             kf.F = np.array([[1.0, 1.0], [0.0, 1.0]])
             kf.H = np.array([[1.0, 0.0]])
             kf.P *= 1000.0
-            kf.R = 10
-            kf.Q = np.eye(2) * 0.001
+            kf.R = r
+            kf.Q = np.eye(2) * q
             return kf
 
-        self.kf_voltage = create_filter()
-        self.kf_current = create_filter()
-        self.kf_power = create_filter()
+        self.kf_voltage = create_filter("voltage")
+        self.kf_current = create_filter("current")
+        self.kf_power = create_filter("power")
+
+    @staticmethod
+    def _kalman_grid_nll(z, q, r, burn_in=2):
+        """Log-vraisemblance négative du filtre pour une grille de (q, r)
+
+        Le filtre à tendance locale (F=[[1,1],[0,1]], H=[1,0], Q=q*I) est
+        déroulé une seule fois sur la série, chaque élément de la grille
+        étant traité en parallèle sous forme vectorisée.
+        """
+        q = np.asarray(q, dtype=float)
+        r = np.asarray(r, dtype=float)
+        x0 = np.full(q.shape, z[0])
+        x1 = np.zeros(q.shape)
+        p00 = np.full(q.shape, 1000.0)
+        p01 = np.zeros(q.shape)
+        p11 = np.full(q.shape, 1000.0)
+        nll = np.zeros(q.shape)
+
+        for i in range(1, len(z)):
+            # Prédiction
+            x0 = x0 + x1
+            p00 = p00 + 2 * p01 + p11 + q
+            p01 = p01 + p11
+            p11 = p11 + q
+            # Mise à jour (innovation y, variance S)
+            s = p00 + r
+            y = z[i] - x0
+            k0 = p00 / s
+            k1 = p01 / s
+            x0 = x0 + k0 * y
+            x1 = x1 + k1 * y
+            p11 = p11 - k1 * p01
+            p01 = p01 - k0 * p01
+            p00 = p00 - k0 * p00
+            if i > burn_in:
+                nll += np.log(s) + y * y / s
+        return nll
+
+    def auto_tune_kalman(self, voltages=None, currents=None, powers=None, n_grid=25):
+        """Estime le bruit de mesure R et de processus Q pour chaque canal
+
+        Les couples (q, r) sont évalués sur une grille logarithmique centrée
+        sur la variance des différences successives de la capture, et le
+        couple de vraisemblance maximale est retenu. R ne descend pas sous
+        la résolution du capteur ; un canal dont le R optimal (ou le Q
+        maximal) tombe au bord de la grille garde ses paramètres actuels.
+        Les filtres sont recréés avec ces paramètres pour la prochaine
+        acquisition.
+        """
+        series = {
+            "voltage": self.voltages if voltages is None else voltages,
+            "current": self.currents if currents is None else currents,
+            "power": self.powers if powers is None else powers,
+        }
+        params = dict(self.kalman_params)
+        for name, values in series.items():
+            z = np.asarray(values, dtype=float)
+            if len(z) < 10:
+                continue
+            floor = self.KALMAN_R_FLOOR[name]
+            scale = max(np.var(np.diff(z)), floor)
+            r_grid = np.logspace(
+                np.log10(max(scale * 1e-3, floor)), np.log10(scale * 10), n_grid
+            )
+            q_grid = scale * np.logspace(-6, 0, n_grid)
+            q, r = np.meshgrid(q_grid, r_grid)
+            nll = self._kalman_grid_nll(z, q.ravel(), r.ravel())
+            i_r, i_q = np.unravel_index(int(np.argmin(nll)), q.shape)
+            # Optimum hors grille : capture trop plate ou trop bruitée pour conclure.
+            # Un Q au bord bas signifie seulement un niveau stable, il est gardé.
+            if i_r in (0, n_grid - 1) or i_q == n_grid - 1:
+                print(f"⚠️ Réglage Kalman non concluant pour {name}, inchangé")
+                continue
+            params[name] = (float(q[i_r, i_q]), float(r[i_r, i_q]))
+
+        self.kalman_params = params
+        self.setup_kalman_filter()
+        return params
+
+    def build_device_commands(self):
+        """Traduit device_config en commandes pour le firmware"""
+        config = self.device_config
+        commands = []
+        if "calibration" in config:
+            commands.append(f"CAL {config['calibration']}".upper())
+        if "averaging" in config:
+            commands.append(f"AVG {int(config['averaging'])}")
+        if "period_ms" in config:
+            commands.append(f"PERIOD {int(config['period_ms'])}")
+        if "lcd_ms" in config:
+            commands.append(f"LCD {int(config['lcd_ms'])}")
+        if "adaptive" in config:
+            adaptive = config["adaptive"]
+            if adaptive:
+                min_ms, max_ms, threshold_mA = adaptive
+                commands.append(
+                    f"ADAPT {int(min_ms)} {int(max_ms)} {float(threshold_mA)}"
+                )
+            else:
+                commands.append("ADAPT OFF")
+        if "aggregate_ms" in config:
+            commands.append(f"AGG {int(config['aggregate_ms'])}")
+        return commands
+
+    def configure_device(self, ser, ready_timeout=5):
+        """Envoie la configuration au firmware et retourne les commandes refusées"""
+        commands = self.build_device_commands()
+        if not commands:
+            return []
+
+        # L'Arduino redémarre à l'ouverture du port : attendre "READY"
+        deadline = time.time() + ready_timeout
+        while time.time() < deadline:
+            if ser.readline().decode("utf-8", errors="ignore").strip() == "READY":
+                break
+
+        rejected = []
+        for command in commands:
+            ser.write(f"{command}\n".encode("utf-8"))
+            deadline = time.time() + ready_timeout
+            while time.time() < deadline:
+                reply = ser.readline().decode("utf-8", errors="ignore").strip()
+                if reply == f"OK {command}":
+                    break
+                if reply == f"ERR {command}":
+                    rejected.append(command)
+                    break
+            else:
+                rejected.append(command)
+
+        for command in rejected:
+            print(f"⚠️ Commande refusée par le firmware: {command}")
+        return rejected
 
     def read_serial_data(self):
         print("⏳ Lecture des données INA219...")
         ser = serial.Serial(self.port, self.baudrate, timeout=1)
-        start_time = time.time()
 
         # Initialiser des listes pour les valeurs supplémentaires
         self.bus_voltages = []
         self.shunt_voltages = []
 
         try:
+            self.configure_device(ser)
+            start_time = time.time()
             while time.time() - start_time < self.duration:
                 line = ser.readline().decode("utf-8").strip()
+                if line.startswith("AGG,"):
+                    self._ingest_aggregate(line)
+                    continue
                 try:
                     # Récupérer toutes les valeurs
                     data = list(map(float, line.split(",")))
@@ -90,33 +275,47 @@ class ConsoLogger:
                     busvoltage = data[3]  # Tension du bus
                     shuntvoltage = data[4]  # Tension de shunt
 
-                    now = datetime.now()
-                    self.timestamps.append(now)
+                    if self.integration == "trapezoid":
+                        now = None
+                        if not self._append_tick(data[5] if len(data) > 5 else None):
+                            continue
+                    else:
+                        now = datetime.now()
+                        self.timestamps.append(now)
                     self.voltages.append(loadvoltage)
                     self.currents.append(current)
                     self.powers.append(power)
                     self.bus_voltages.append(busvoltage)
                     self.shunt_voltages.append(shuntvoltage)
+                    if len(data) > 7:
+                        self.current_peaks.append((data[6], data[7]))
 
                     # Filtrage Kalman
                     self.kf_voltage.predict()
                     self.kf_voltage.update(loadvoltage)
-                    voltage_k = float(self.kf_voltage.x[0])
+                    voltage_k = float(self.kf_voltage.x[0, 0])
 
                     self.kf_current.predict()
                     self.kf_current.update(current)
-                    current_k = float(self.kf_current.x[0])
+                    current_k = float(self.kf_current.x[0, 0])
 
                     self.kf_power.predict()
                     self.kf_power.update(power)
-                    power_k = float(self.kf_power.x[0])
+                    power_k = float(self.kf_power.x[0, 0])
 
                     self.voltages_kalman.append(voltage_k)
                     self.currents_kalman.append(current_k)
                     self.powers_kalman.append(power_k)
+                    self._append_series(
+                        power, current, loadvoltage, power_k, current_k, voltage_k
+                    )
 
                     # Calcul de l'énergie et charge accumulées
-                    if len(self.timestamps) > 1:
+                    if now is None:
+                        pending = len(self.ticks_ns) - self._integrated_upto
+                        if pending > self.integration_batch:
+                            self._integrate_batch()
+                    elif len(self.timestamps) > 1:
                         delta_t = (
                             self.timestamps[-1] - self.timestamps[-2]
                         ).total_seconds() / 3600
@@ -127,7 +326,7 @@ class ConsoLogger:
                         self.total_charge_mAh_filtered += current_k * delta_t
 
                     print(
-                        f"{now.strftime('%H:%M:%S')} | "
+                        f"{self._format_time(now)} | "
                         f"Load: {loadvoltage:.2f}V | "
                         f"Bus: {busvoltage:.2f}V | "
                         f"Shunt: {shuntvoltage:.2f}mV | "
@@ -138,17 +337,367 @@ class ConsoLogger:
                     continue
         finally:
             ser.close()
+            if self.integration == "trapezoid":
+                self._integrate_batch()
+                self._finalize_timestamps()
+
+    def _append_tick(self, device_micros=None):
+        """Ajoute l'horodatage entier (ns) d'une mesure en mode trapèzes
+
+        La source (micros() de l'appareil ou horloge monotone de l'hôte) est
+        fixée à la première mesure ; le débordement du compteur micros()
+        (2^32 µs, environ 71 min) est compensé. Un recul du compteur qui ne
+        s'explique pas par un débordement est un redémarrage de la carte :
+        la mesure est recalée sur l'horloge hôte, au-delà du seuil de trou.
+        """
+        if self._tick_source is None:
+            self._tick_source = "host" if device_micros is None else "device"
+        if self._tick_source == "host":
+            self.ticks_ns.append(time.monotonic_ns())
+            return True
+        if device_micros is None:
+            return False
+
+        micros = int(device_micros)
+        host_ns = time.monotonic_ns()
+        if self._last_micros is not None and micros < self._last_micros:
+            gap_ns = int(self._gap_threshold_s() * 1e9)
+            if (micros + 2**32 - self._last_micros) * 1000 <= gap_ns:
+                self._micros_offset += 2**32
+            else:
+                elapsed_ns = max(host_ns - self._last_host_ns, gap_ns + 1000000)
+                self._micros_offset = (self.ticks_ns[-1] + elapsed_ns) // 1000 - micros
+        self._last_micros = micros
+        self._last_host_ns = host_ns
+        self.ticks_ns.append((micros + self._micros_offset) * 1000)
+        return True
+
+    def _gap_threshold_s(self):
+        """Seuil au-delà duquel un intervalle est un trou
+
+        max_gap_s, relevé au double de la plus longue période d'envoi
+        configurée sur la carte (PERIOD ou maximum du mode adaptatif).
+        """
+        periods_ms = [self.device_config.get("period_ms", 0)]
+        adaptive = self.device_config.get("adaptive")
+        if adaptive:
+            periods_ms.append(adaptive[1])
+        return max(self.max_gap_s, 2 * max(periods_ms) / 1000)
+
+    def _integrate_batch(self):
+        """Intègre par trapèzes les mesures en attente sur les horodatages en ns
+
+        Les intervalles plus longs que le seuil de trou sont signalés dans
+        gaps au lieu d'être intégrés.
+        """
+        if self.aggregates:
+            return  # Totaux déjà intégrés par l'appareil
+        start = max(self._integrated_upto - 1, 0)
+        end = len(self.ticks_ns)
+        if end - start < 2:
+            return
+
+        ticks = np.array(self.ticks_ns[start:end], dtype=np.int64)
+        dt_ns = np.diff(ticks)
+        gaps = dt_ns > int(self._gap_threshold_s() * 1e9)
+        for i in np.flatnonzero(gaps):
+            self.gaps.append((start + int(i), float(dt_ns[i] / 1e9)))
+        dt_h = np.where(gaps, 0, dt_ns) / 3.6e12
+
+        def trapezoid(values):
+            v = np.array(values[start:end], dtype=float)
+            return float(np.sum((v[1:] + v[:-1]) / 2 * dt_h))
+
+        self.total_energy_mWh_raw += trapezoid(self.powers)
+        self.total_energy_mWh_filtered += trapezoid(self.powers_kalman)
+        self.total_charge_mAh_raw += trapezoid(self.currents)
+        self.total_charge_mAh_filtered += trapezoid(self.currents_kalman)
+        self.integrated_duration_s += float(np.sum(dt_h)) * 3600
+        self._integrated_upto = end
+
+    def _finalize_timestamps(self):
+        """Reconstruit les datetime des mesures à partir des horodatages en ns"""
+        if not self.ticks_ns:
+            return
+        ticks = np.array(self.ticks_ns, dtype=np.int64)
+        anchor = np.datetime64(datetime.now(), "ns") - (ticks[-1] - ticks[0])
+        offsets = (ticks - ticks[0]).astype("timedelta64[ns]")
+        self.timestamps = (anchor + offsets).astype("datetime64[us]").tolist()
+
+    def _format_time(self, now):
+        if now is not None:
+            return now.strftime("%H:%M:%S")
+        return f"{(self.ticks_ns[-1] - self.ticks_ns[0]) / 1e9:.3f}s"
+
+    def _ingest_aggregate(self, line):
+        """Intègre un résumé d'intervalle envoyé par le firmware en mode AGG
+
+        Format : AGG,durée_ms,n,V moy,V min,V max,mA moy,mA min,mA max,
+        mW moy,mW min,mW max,mAh,mWh
+        """
+        try:
+            data = list(map(float, line.split(",")[1:]))
+        except ValueError:
+            return False
+        if len(data) < 13:
+            return False
+
+        duration_s = data[0] / 1000
+        record = {
+            "duration_s": duration_s,
+            "count": int(data[1]),
+            "voltage": {"mean": data[2], "min": data[3], "max": data[4]},
+            "current": {"mean": data[5], "min": data[6], "max": data[7]},
+            "power": {"mean": data[8], "min": data[9], "max": data[10]},
+            "charge_mAh": data[11],
+            "energy_mWh": data[12],
+        }
+        self.aggregates.append(record)
+        self.device_duration_s += duration_s
+
+        # Les moyennes d'intervalle alimentent les séries habituelles
+        if self.integration == "trapezoid":
+            now = None
+            self.ticks_ns.append(time.monotonic_ns())
+        else:
+            now = datetime.now()
+            self.timestamps.append(now)
+        self.voltages.append(record["voltage"]["mean"])
+        self.currents.append(record["current"]["mean"])
+        self.powers.append(record["power"]["mean"])
+        self.bus_voltages.append(float("nan"))
+        self.shunt_voltages.append(float("nan"))
+
+        self.kf_voltage.predict()
+        self.kf_voltage.update(record["voltage"]["mean"])
+        self.kf_current.predict()
+        self.kf_current.update(record["current"]["mean"])
+        self.kf_power.predict()
+        self.kf_power.update(record["power"]["mean"])
+        voltage_k = float(self.kf_voltage.x[0, 0])
+        current_k = float(self.kf_current.x[0, 0])
+        power_k = float(self.kf_power.x[0, 0])
+        self.voltages_kalman.append(voltage_k)
+        self.currents_kalman.append(current_k)
+        self.powers_kalman.append(power_k)
+        self._append_series(
+            record["power"]["mean"],
+            record["current"]["mean"],
+            record["voltage"]["mean"],
+            power_k,
+            current_k,
+            voltage_k,
+        )
+
+        # Totaux bruts intégrés par l'appareil, sans dépendre de l'horloge hôte
+        delta_t = duration_s / 3600
+        self.total_energy_mWh_raw += record["energy_mWh"]
+        self.total_charge_mAh_raw += record["charge_mAh"]
+        self.total_energy_mWh_filtered += power_k * delta_t
+        self.total_charge_mAh_filtered += current_k * delta_t
+
+        print(
+            f"{self._format_time(now)} | "
+            f"Intervalle: {duration_s:.1f}s ({record['count']} mesures) | "
+            f"Current: {record['current']['mean']:.2f}mA "
+            f"[{record['current']['min']:.2f}, {record['current']['max']:.2f}] | "
+            f"Power: {record['power']['mean']:.2f}mW | "
+            f"{record['charge_mAh']:.4f}mAh / {record['energy_mWh']:.4f}mWh"
+        )
+        return True
 
     def compute_averages(self):
-        if not self.powers:
+        report = self.compute_report()
+        if report is None:
             print("❌ Aucune donnée reçue.")
             return False
-        self.avg_power_raw = sum(self.powers) / len(self.powers)
-        self.avg_current_raw = sum(self.currents) / len(self.currents)
-        self.avg_power_kalman = sum(self.powers_kalman) / len(self.powers_kalman)
-        self.avg_current_kalman = sum(self.currents_kalman) / len(self.currents_kalman)
+        self.avg_power_raw = report["avg_power_raw"]
+        self.avg_current_raw = report["avg_current_raw"]
+        self.avg_power_kalman = report["avg_power_kalman"]
+        self.avg_current_kalman = report["avg_current_kalman"]
         return True
 
+    def _reserve_series(self, n):
+        if n > self._series.shape[1]:
+            grown = np.empty((6, max(n, 2 * self._series.shape[1], 1024)))
+            grown[:, : self._series_len] = self._series[:, : self._series_len]
+            self._series = grown
+
+    def _append_series(self, power, current, voltage, power_k, current_k, voltage_k):
+        """Ajoute une mesure au tampon numpy du rapport"""
+        n = self._series_len
+        self._reserve_series(n + 1)
+        self._series[:, n] = (power, current, voltage, power_k, current_k, voltage_k)
+        self._series_len = n + 1
+
+    def _series_arrays(self):
+        """Séries du rapport sous forme de tableau (6, n)
+
+        Les mesures ajoutées aux listes hors acquisition sont converties une
+        seule fois ; le tampon est reconstruit si les listes ont été vidées.
+        """
+        n = len(self.powers)
+        if self._series_len > n:
+            self._series_len = 0
+            self._series_stats_len = None
+        if self._series_len < n:
+            start = self._series_len
+            self._reserve_series(n)
+            for row, values in enumerate(
+                (
+                    self.powers,
+                    self.currents,
+                    self.voltages,
+                    self.powers_kalman,
+                    self.currents_kalman,
+                    self.voltages_kalman,
+                )
+            ):
+                self._series[row, start:n] = values[start:n]
+            self._series_len = n
+        return self._series[:, :n]
+
+    def _series_statistics(self):
+        """Moyenne, min, max, écart type et médiane de chaque série
+
+        Mémorisés sur le nombre de mesures : un rapport invalidé seulement
+        par les totaux ou les durées ne reparcourt pas les séries.
+        """
+        data = self._series_arrays()
+        if self._series_stats_len != data.shape[1]:
+            self._series_stats = (
+                data.mean(axis=1),
+                data.min(axis=1),
+                data.max(axis=1),
+                data.std(axis=1),
+                np.median(data, axis=1),
+            )
+            self._series_stats_len = data.shape[1]
+        return [values.copy() for values in self._series_stats]
+
+    def compute_report(self):
+        """Calcule en une seule passe vectorisée toutes les grandeurs du rapport
+
+        Le résultat est mémorisé tant que les données et la configuration
+        ne changent pas : récapitulatif console, fichier de résultats, titre
+        du graphe et interface Flet lisent le même rapport.
+        """
+        if not self.powers:
+            return None
+        # Toute donnée dont dépend le rapport fait partie de la clé, pour
+        # qu'une lecture pendant l'acquisition ne renvoie pas de totaux périmés
+        key = (
+            len(self.powers),
+            len(self.aggregates),
+            len(self.gaps),
+            len(self.current_peaks),
+            self.timestamps[0] if self.timestamps else None,
+            self.timestamps[-1] if self.timestamps else None,
+            self.total_energy_mWh_raw,
+            self.total_energy_mWh_filtered,
+            self.total_charge_mAh_raw,
+            self.total_charge_mAh_filtered,
+            self.integrated_duration_s,
+            self.device_duration_s,
+            self.battery_voltage,
+            self.safety_margin,
+            self.target_days,
+            self.voltage_min,
+            self.voltage_max,
+            self.current_max,
+        )
+        if self._report is not None and self._report_key == key:
+            return self._report
+
+        names = ["power", "current", "voltage"]
+        means, mins, maxs, stds, medians = self._series_statistics()
+
+        if self.aggregates:
+            # Extrêmes réels mesurés par l'appareil, pas ceux des moyennes
+            extremes = np.array(
+                [
+                    [[r[name]["min"], r[name]["max"]] for name in names]
+                    for r in self.aggregates
+                ]
+            )
+            mins[:3] = extremes[:, :, 0].min(axis=0)
+            maxs[:3] = extremes[:, :, 1].max(axis=0)
+        elif self.current_peaks:
+            # Transitoires lus par le firmware entre deux lignes envoyées
+            peaks = np.array(self.current_peaks, dtype=float)
+            mins[1] = min(mins[1], peaks[:, 0].min())
+            maxs[1] = max(maxs[1], peaks[:, 1].max())
+
+        stats = {}
+        for i, name in enumerate(names):
+            stats[name] = {}
+            for j, kind in ((i, "raw"), (i + 3, "kalman")):
+                stats[name][kind] = {
+                    "min": float(mins[j]),
+                    "max": float(maxs[j]),
+                    "std": float(stds[j]),
+                    "median": float(medians[j]),
+                }
+
+        # Calcul de la durée réelle d'acquisition en heures
+        if self.aggregates:
+            duration_hours = self.device_duration_s / 3600
+        elif self.integration == "trapezoid":
+            # Durée effectivement intégrée, hors trous signalés
+            duration_hours = self.integrated_duration_s / 3600
+        else:
+            duration_hours = (
+                self.timestamps[-1] - self.timestamps[0]
+            ).total_seconds() / 3600
+
+        if self.aggregates and duration_hours > 0:
+            # Moyennes exactes issues des totaux intégrés par l'appareil
+            avg_power_raw = self.total_energy_mWh_raw / duration_hours
+            avg_current_raw = self.total_charge_mAh_raw / duration_hours
+        else:
+            avg_power_raw = float(means[0])
+            avg_current_raw = float(means[1])
+        avg_power_kalman = float(means[3])
+        avg_current_kalman = float(means[4])
+
+        # Méthode 1: Utilisation des données accumulées (plus précise)
+        # Extrapolation à 24h des mWh accumulés, convertis en Wh
+        if duration_hours > 0:
+            wh_raw = self.total_energy_mWh_raw / 1000 * (24 / duration_hours)
+            wh_kal = self.total_energy_mWh_filtered / 1000 * (24 / duration_hours)
+        else:
+            wh_raw = wh_kal = 0.0
+
+        # Méthode 2: Utilisation de la puissance moyenne (alternative)
+        # wh_raw_alt, mah_raw_alt = self.estimate_24h(avg_power_raw)
+        # wh_kal_alt, mah_kal_alt = self.estimate_24h(avg_power_kalman)
+
+        self._report = {
+            "samples": len(self.powers),
+            "duration_hours": duration_hours,
+            "avg_power_raw": avg_power_raw,
+            "avg_current_raw": avg_current_raw,
+            "avg_power_kalman": avg_power_kalman,
+            "avg_current_kalman": avg_current_kalman,
+            "wh_raw": wh_raw,
+            "wh_kal": wh_kal,
+            "mah_raw": (wh_raw * 1000) / self.battery_voltage,
+            "mah_kal": (wh_kal * 1000) / self.battery_voltage,
+            "battery_raw": self.estimate_required_battery(avg_power_raw),
+            "battery_kal": self.estimate_required_battery(avg_power_kalman),
+            "stats": stats,
+            "gap_count": len(self.gaps),
+            "gap_total_s": sum(duration for _, duration in self.gaps),
+            "alerts": self.check_thresholds(),
+        }
+        if self.gaps:
+            self._report["alerts"].append(
+                f"⚠️ Trous d'acquisition: {self._report['gap_count']} "
+                f"({self._report['gap_total_s']:.1f}s au total, non intégrés)"
+            )
+        self._report_key = key
+        return self._report
+
     def estimate_24h(self, power_mW):
         # Correction : suppression des doubles affectations
         wh = (power_mW * 24) / 1000  # mW * h / 1000 = Wh
@@ -177,6 +726,9 @@ class ConsoLogger:
         return predictions
 
     def export_csv(self):
+        blocks = []
+        block = None
+        prev = None
         with open(self.csv_file, "w", newline="") as f:
             writer = csv.writer(f)
             writer.writerow(
@@ -191,6 +743,11 @@ class ConsoLogger:
                 ]
             )
             for i in range(len(self.timestamps)):
+                # Nouveau bloc d'index : on mémorise sa position dans le fichier
+                if i % self.index_block_size == 0:
+                    if block:
+                        blocks.append(self._close_index_block(block))
+                    block = self._new_index_block(f.tell(), prev)
                 writer.writerow(
                     [
                         self.timestamps[i],
@@ -202,8 +759,203 @@ class ConsoLogger:
                         self.powers_kalman[i],
                     ]
                 )
+                t = self.timestamps[i].timestamp()
+                self._update_index_block(
+                    block, t, self.voltages[i], self.currents[i], self.powers[i]
+                )
+                prev = [t, self.currents[i], self.powers[i]]
+            if block:
+                blocks.append(self._close_index_block(block))
+            size = f.tell()
+        self._write_index(blocks, size)
         print(f"✅ Données sauvegardées dans {self.csv_file}")
 
+    def _index_file(self):
+        return os.path.splitext(self.csv_file)[0] + ".idx.json"
+
+    @staticmethod
+    def _new_index_block(offset, prev):
+        # prev : [t, courant, puissance] de la ligne précédant le bloc
+        block = {
+            "offset": offset,
+            "prev": prev,
+            "last": prev,
+            "t_start": None,
+            "t_end": None,
+            "count": 0,
+            "energy_mWh": 0.0,
+            "charge_mAh": 0.0,
+        }
+        for name in ("voltage", "current", "power"):
+            block[name] = {"min": float("inf"), "max": float("-inf"), "sum": 0.0}
+        return block
+
+    def _interval_energy(self, last, t, current, power):
+        """Énergie (mWh) et charge (mAh) de l'intervalle entre last et t
+
+        Suit le mode d'intégration du logger : rectangles à droite, ou
+        trapèzes avec les intervalles plus longs que le seuil de trou ignorés.
+        """
+        t_last, current_last, power_last = last
+        delta_s = t - t_last
+        if self.integration == "trapezoid":
+            if delta_s > self._gap_threshold_s():
+                return 0.0, 0.0
+            power = (power + power_last) / 2
+            current = (current + current_last) / 2
+        delta_t = delta_s / 3600
+        return power * delta_t, current * delta_t
+
+    def _update_index_block(self, block, t, voltage, current, power):
+        if block["t_start"] is None:
+            block["t_start"] = t
+        if block["last"] is not None:
+            energy, charge = self._interval_energy(block["last"], t, current, power)
+            block["energy_mWh"] += energy
+            block["charge_mAh"] += charge
+        block["last"] = [t, current, power]
+        block["t_end"] = t
+        block["count"] += 1
+        for name, value in (
+            ("voltage", voltage),
+            ("current", current),
+            ("power", power),
+        ):
+            agg = block[name]
+            agg["min"] = min(agg["min"], value)
+            agg["max"] = max(agg["max"], value)
+            agg["sum"] += value
+
+    @staticmethod
+    def _close_index_block(block):
+        del block["last"]
+        for name in ("voltage", "current", "power"):
+            agg = block[name]
+            agg["mean"] = agg.pop("sum") / block["count"]
+        return block
+
+    def _write_index(self, blocks, size):
+        with open(self._index_file(), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "block_size": self.index_block_size,
+                    "integration": self.integration,
+                    "max_gap_s": self._gap_threshold_s(),
+                    "size": size,
+                    "mtime_ns": os.stat(self.csv_file).st_mtime_ns,
+                    "blocks": blocks,
+                },
+                f,
+            )
+
+    @staticmethod
+    def _parse_csv_line(line):
+        fields = line.decode("utf-8").strip().split(",")
+        return datetime.fromisoformat(fields[0]), list(map(float, fields[1:]))
+
+    def build_csv_index(self):
+        """Construit l'index annexe d'un CSV existant (positions et agrégats par bloc)"""
+        blocks = []
+        block = None
+        prev = None
+        with open(self.csv_file, "rb") as f:
+            offset = len(f.readline())  # en-tête
+            i = 0
+            for line in f:
+                if not line.strip():
+                    offset += len(line)
+                    continue
+                if i % self.index_block_size == 0:
+                    if block:
+                        blocks.append(self._close_index_block(block))
+                    block = self._new_index_block(offset, prev)
+                ts, values = self._parse_csv_line(line)
+                t = ts.timestamp()
+                self._update_index_block(block, t, values[0], values[1], values[2])
+                prev = [t, values[1], values[2]]
+                offset += len(line)
+                i += 1
+        if block:
+            blocks.append(self._close_index_block(block))
+        self._write_index(blocks, offset)
+        return blocks
+
+    def load_csv_index(self):
+        """Charge l'index annexe, en le reconstruisant s'il est absent ou périmé"""
+        try:
+            with open(self._index_file(), encoding="utf-8") as f:
+                index = json.load(f)
+            if (
+                index["size"] == os.path.getsize(self.csv_file)
+                and index["mtime_ns"] == os.stat(self.csv_file).st_mtime_ns
+                and index["block_size"] == self.index_block_size
+                and index["integration"] == self.integration
+                and index["max_gap_s"] == self._gap_threshold_s()
+            ):
+                return index["blocks"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return self.build_csv_index()
+
+    def _read_index_block(self, f, block):
+        f.seek(block["offset"])
+        for _ in range(block["count"]):
+            yield self._parse_csv_line(f.readline())
+
+    def load_csv_range(self, start, end):
+        """Charge uniquement les lignes du CSV comprises entre start et end"""
+        columns = [
+            "timestamp",
+            "voltage_V",
+            "current_mA",
+            "power_mW",
+            "voltage_kalman",
+            "current_kalman",
+            "power_kalman",
+        ]
+        data = {name: [] for name in columns}
+        t1, t2 = start.timestamp(), end.timestamp()
+        with open(self.csv_file, "rb") as f:
+            for block in self.load_csv_index():
+                if block["t_end"] < t1:
+                    continue
+                if block["t_start"] > t2:
+                    break
+                for ts, values in self._read_index_block(f, block):
+                    if t1 <= ts.timestamp() <= t2:
+                        data["timestamp"].append(ts)
+                        for name, value in zip(columns[1:], values):
+                            data[name].append(value)
+        return data
+
+    def energy_between(self, start, end):
+        """Énergie (mWh) et charge (mAh) consommées entre start et end
+
+        Les blocs entièrement contenus dans l'intervalle sont répondus
+        depuis l'index ; seuls les blocs de bord sont relus.
+        """
+        energy, charge = 0.0, 0.0
+        t1, t2 = start.timestamp(), end.timestamp()
+        with open(self.csv_file, "rb") as f:
+            for block in self.load_csv_index():
+                if block["t_end"] <= t1:
+                    continue
+                if block["t_start"] > t2:
+                    break
+                if block["t_start"] > t1 and block["t_end"] <= t2:
+                    energy += block["energy_mWh"]
+                    charge += block["charge_mAh"]
+                    continue
+                last = block["prev"]
+                for ts, values in self._read_index_block(f, block):
+                    t = ts.timestamp()
+                    if last is not None and t1 < t <= t2:
+                        e, q = self._interval_energy(last, t, values[1], values[2])
+                        energy += e
+                        charge += q
+                    last = [t, values[1], values[2]]
+        return energy, charge
+
     def plot_graph(self):
         pred = self.predict_next()
         time_interval = (
@@ -273,53 +1025,10 @@ class ConsoLogger:
 
     def compute_statistics(self):
         """Calcule les statistiques détaillées"""
-        if not self.powers:
+        report = self.compute_report()
+        if report is None:
             return False
-
-        self.stats = {
-            "power": {
-                "raw": {
-                    "min": min(self.powers),
-                    "max": max(self.powers),
-                    "std": np.std(self.powers),
-                    "median": np.median(self.powers),
-                },
-                "kalman": {
-                    "min": min(self.powers_kalman),
-                    "max": max(self.powers_kalman),
-                    "std": np.std(self.powers_kalman),
-                    "median": np.median(self.powers_kalman),
-                },
-            },
-            "current": {
-                "raw": {
-                    "min": min(self.currents),
-                    "max": max(self.currents),
-                    "std": np.std(self.currents),
-                    "median": np.median(self.currents),
-                },
-                "kalman": {
-                    "min": min(self.currents_kalman),
-                    "max": max(self.currents_kalman),
-                    "std": np.std(self.currents_kalman),
-                    "median": np.median(self.currents_kalman),
-                },
-            },
-            "voltage": {
-                "raw": {
-                    "min": min(self.voltages),
-                    "max": max(self.voltages),
-                    "std": np.std(self.voltages),
-                    "median": np.median(self.voltages),
-                },
-                "kalman": {
-                    "min": min(self.voltages_kalman),
-                    "max": max(self.voltages_kalman),
-                    "std": np.std(self.voltages_kalman),
-                    "median": np.median(self.voltages_kalman),
-                },
-            },
-        }
+        self.stats = report["stats"]
         return True
 
     def save_results(self):
@@ -362,7 +1071,7 @@ class ConsoLogger:
             )
 
             # Ajout des alertes
-            alerts = self.check_thresholds()
+            alerts = self.compute_report()["alerts"]
             if alerts:
                 f.write("\nALERTES:\n")
                 for alert in alerts:
@@ -407,31 +1116,15 @@ class ConsoLogger:
         if not self.compute_averages():
             return
 
-        # Calcul de la durée réelle d'acquisition en heures
-        self.duration_hours = (
-            self.timestamps[-1] - self.timestamps[0]
-        ).total_seconds() / 3600
-
-        # Méthode 1: Utilisation des données accumulées (plus précise)
-        # Conversion mWh -> Wh pour l'énergie
-        real_wh_raw = self.total_energy_mWh_raw / 1000
-        real_wh_filtered = self.total_energy_mWh_filtered / 1000
-
-        # Extrapolation à 24h
-        self.wh_raw = real_wh_raw * (24 / self.duration_hours)
-        self.wh_kal = real_wh_filtered * (24 / self.duration_hours)
-
-        # Conversion en mAh
-        self.mah_raw = (self.wh_raw * 1000) / self.battery_voltage
-        self.mah_kal = (self.wh_kal * 1000) / self.battery_voltage
-
-        # Méthode 2: Utilisation de la puissance moyenne (alternative)
-        # wh_raw_alt, mah_raw_alt = self.estimate_24h(self.avg_power_raw)
-        # wh_kal_alt, mah_kal_alt = self.estimate_24h(self.avg_power_kalman)
-
-        # Estimation de la batterie requise
-        self.battery_raw = self.estimate_required_battery(self.avg_power_raw)
-        self.battery_kal = self.estimate_required_battery(self.avg_power_kalman)
+        # Estimations 24h et batterie requise, issues du rapport mémorisé
+        report = self.compute_report()
+        self.duration_hours = report["duration_hours"]
+        self.wh_raw = report["wh_raw"]
+        self.wh_kal = report["wh_kal"]
+        self.mah_raw = report["mah_raw"]
+        self.mah_kal = report["mah_kal"]
+        self.battery_raw = report["battery_raw"]
+        self.battery_kal = report["battery_kal"]
 
         self.export_csv()
         self.plot_graph()
@@ -439,6 +1132,11 @@ class ConsoLogger:
         margin_percent = int(self.safety_margin * 100)
         print("\n====== 🔎 RÉCAPITULATIF DEBUG ======")
         print(f"📏 Durée d'acquisition : {self.duration_hours:.2f} heures")
+        if report["gap_count"]:
+            print(
+                f"🕳️ Trous d'acquisition : {report['gap_count']} "
+                f"({report['gap_total_s']:.1f} s, non intégrés)"
+            )
         print(f"🔋 Tension batterie : {self.battery_voltage:.2f} V")
         print(f"📆 Jours cibles : {self.target_days} j")
         print(f"⚠️ Marge de sécurité : {self.safety_margin:.2f} ({margin_percent}%)")
@@ -470,7 +1168,7 @@ class ConsoLogger:
         self.compute_statistics()
         print(self.stats)
         print("=-> alertes:")
-        for alert in self.check_thresholds():
+        for alert in report["alerts"]:
             print(alert)
         print("-------------")
         print("=-> sauvegarde:")
@@ -32,7 +32,7 @@ class AnalyseurConsommationApp:
         # Champs de configuration
         self.page = page
         self.port_input = ft.TextField(label="Port série", value="COM3", width=300)
-        self.baudrate_input = ft.TextField(label="Baudrate", value="9600", width=300)
+        self.baudrate_input = ft.TextField(label="Baudrate", value="115200", width=300)
         self.duration_input = ft.TextField(
             label="Durée d'enregistrement (s)", value="10", width=300
         )
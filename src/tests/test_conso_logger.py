@@ -1,5 +1,10 @@
+import os
+import tempfile
 import unittest
+from datetime import datetime, timedelta
 from unittest.mock import patch
+
+import numpy as np
 from consol import ConsoLogger
 
 
@@ -43,3 +48,323 @@ class TestConsoLogger(unittest.TestCase):
         self.assertIsNotNone(logger.kf_voltage)
         self.assertIsNotNone(logger.kf_current)
         self.assertIsNotNone(logger.kf_power)
+
+    def test_auto_tune_kalman(self):
+        rng = np.random.default_rng(0)
+        voltages = 5.0 + rng.normal(0, 0.02, 2000)
+        currents = 100.0 + rng.normal(0, 5.0, 2000)
+        logger = ConsoLogger()
+        params = logger.auto_tune_kalman(voltages, currents, voltages * currents)
+        # R estimé proche de la variance réelle du bruit de chaque canal
+        self.assertAlmostEqual(params["voltage"][1], 0.02**2, delta=0.0002)
+        self.assertAlmostEqual(params["current"][1], 5.0**2, delta=10)
+        self.assertEqual(logger.kf_voltage.R, params["voltage"][1])
+        # Les paramètres sont réutilisables pour la prochaine acquisition
+        tuned = ConsoLogger(kalman_params=params)
+        self.assertEqual(tuned.kf_current.R, params["current"][1])
+
+    def test_auto_tune_kalman_skips_flat_capture(self):
+        # Capture constante : aucun bruit mesurable, les défauts sont conservés
+        logger = ConsoLogger()
+        flat = [5.0] * 200
+        params = logger.auto_tune_kalman(flat, flat, flat)
+        self.assertEqual(params, {})
+        self.assertEqual(logger.kf_voltage.R, 10)
+
+    def _logger_with_samples(self, tmpdir, n=250):
+        logger = ConsoLogger(
+            csv_file=os.path.join(tmpdir, "mesures.csv"), index_block_size=32
+        )
+        t0 = datetime(2025, 1, 1, 12, 0, 0)
+        for i in range(n):
+            logger.timestamps.append(t0 + timedelta(seconds=i, microseconds=i * 7))
+            logger.voltages.append(5.0)
+            logger.currents.append(100.0 + i % 7)
+            logger.powers.append(500.0 + i % 11)
+            logger.voltages_kalman.append(5.0)
+            logger.currents_kalman.append(100.0)
+            logger.powers_kalman.append(500.0)
+        return logger
+
+    def test_csv_index_range_and_energy(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger = self._logger_with_samples(tmpdir)
+            logger.export_csv()
+            self.assertTrue(os.path.exists(logger._index_file()))
+            start, end = logger.timestamps[40], logger.timestamps[170]
+
+            data = logger.load_csv_range(start, end)
+            self.assertEqual(data["timestamp"], logger.timestamps[40:171])
+            self.assertEqual(data["power_mW"], logger.powers[40:171])
+
+            # Référence : intégration ligne à ligne sur ]start, end]
+            energy, charge = 0.0, 0.0
+            for i in range(41, 171):
+                dt = (logger.timestamps[i] - logger.timestamps[i - 1]).total_seconds()
+                energy += logger.powers[i] * dt / 3600
+                charge += logger.currents[i] * dt / 3600
+            got_energy, got_charge = logger.energy_between(start, end)
+            self.assertAlmostEqual(got_energy, energy)
+            self.assertAlmostEqual(got_charge, charge)
+
+    def test_csv_index_rebuilt_when_missing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger = self._logger_with_samples(tmpdir)
+            logger.export_csv()
+            with open(logger._index_file(), encoding="utf-8") as f:
+                written = f.read()
+            os.remove(logger._index_file())
+            blocks = logger.load_csv_index()
+            self.assertEqual(len(blocks), 8)
+            with open(logger._index_file(), encoding="utf-8") as f:
+                self.assertEqual(f.read(), written)
+
+    def test_build_device_commands(self):
+        logger = ConsoLogger(
+            device_config={
+                "calibration": "320mA",
+                "averaging": 8,
+                "period_ms": 200,
+                "lcd_ms": 0,
+                "adaptive": (50, 2000, 5),
+            }
+        )
+        self.assertEqual(
+            logger.build_device_commands(),
+            ["CAL 320MA", "AVG 8", "PERIOD 200", "LCD 0", "ADAPT 50 2000 5.0"],
+        )
+
+    @patch("serial.Serial")
+    def test_configure_device(self, mock_serial):
+        ser = mock_serial.return_value
+        ser.readline.side_effect = [b"READY\r\n", b"OK AVG 8\r\n"]
+        logger = ConsoLogger(device_config={"averaging": 8})
+        self.assertEqual(logger.configure_device(ser), [])
+        ser.write.assert_called_once_with(b"AVG 8\n")
+
+        ser.readline.side_effect = [b"READY\r\n", b"ERR AVG 3\r\n"]
+        logger.device_config = {"averaging": 3}
+        self.assertEqual(logger.configure_device(ser), ["AVG 3"])
+
+    @patch("serial.Serial")
+    def test_run_with_device_aggregates(self, mock_serial):
+        lines = [
+            b"AGG,1000.000,850,5.010,5.000,5.020,100.000,90.000,400.000,"
+            b"501.000,450.000,2000.000,0.030000,0.150000\r\n"
+        ] * 4
+        pending = iter(lines)
+        mock_serial.return_value.readline.side_effect = lambda: next(pending, b"")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger = ConsoLogger(
+                duration=1,
+                csv_file=os.path.join(tmpdir, "mesures.csv"),
+                img_file=os.path.join(tmpdir, "courbe.png"),
+                battery_voltage=5.0,
+            )
+            logger.run()
+        self.assertEqual(len(logger.aggregates), 4)
+        self.assertAlmostEqual(logger.total_energy_mWh_raw, 0.6)
+        self.assertAlmostEqual(logger.total_charge_mAh_raw, 0.12)
+        # Estimations basées sur les totaux intégrés par l'appareil (4 s)
+        self.assertAlmostEqual(logger.duration_hours, 4 / 3600)
+        self.assertAlmostEqual(logger.avg_power_raw, 540.0)
+        self.assertAlmostEqual(logger.wh_raw, 0.6 / 1000 * 24 * 900)
+
+    def test_compute_report_is_memoized(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger = self._logger_with_samples(tmpdir, n=100)
+            logger.total_energy_mWh_raw = 12.0
+            with patch.object(
+                logger, "check_thresholds", wraps=logger.check_thresholds
+            ) as check:
+                report = logger.compute_report()
+                self.assertIs(logger.compute_report(), report)
+                self.assertTrue(logger.compute_statistics())
+                self.assertEqual(check.call_count, 1)
+            self.assertAlmostEqual(report["avg_power_raw"], np.mean(logger.powers))
+            self.assertEqual(report["stats"]["current"]["raw"]["max"], 106.0)
+            self.assertAlmostEqual(
+                report["stats"]["power"]["raw"]["median"], np.median(logger.powers)
+            )
+            self.assertAlmostEqual(report["wh_raw"], 12.0 / 1000 * 24 / (99 / 3600), 3)
+
+            # Totaux ou horodatages modifiés : le rapport est recalculé
+            logger.total_energy_mWh_raw = 24.0
+            self.assertAlmostEqual(
+                logger.compute_report()["wh_raw"], 24.0 / 1000 * 24 / (99 / 3600), 3
+            )
+            logger.timestamps[-1] += timedelta(seconds=99)
+            self.assertAlmostEqual(
+                logger.compute_report()["duration_hours"], 198 / 3600, 3
+            )
+
+            # Nouvelle mesure : le rapport est recalculé
+            logger.powers.append(10000.0)
+            logger.currents.append(100.0)
+            logger.voltages.append(5.0)
+            logger.powers_kalman.append(500.0)
+            logger.currents_kalman.append(100.0)
+            logger.voltages_kalman.append(5.0)
+            logger.timestamps.append(logger.timestamps[-1] + timedelta(seconds=1))
+            self.assertEqual(
+                logger.compute_report()["stats"]["power"]["raw"]["max"], 10000.0
+            )
+            # Seule la nouvelle mesure a été convertie dans le tampon numpy
+            self.assertEqual(logger._series_len, 101)
+
+    @patch("serial.Serial")
+    def test_trapezoid_integration_with_device_micros(self, mock_serial):
+        # Échantillons toutes les 0,5 s, débordement de micros() puis trou de 10 s
+        micros = [2**32 - 1500000 + k * 500000 for k in range(8)]
+        micros += [micros[-1] + 10000000 + k * 500000 for k in range(3)]
+        lines = [
+            f"5.000,{100 + k},{500 + 2 * k},5.000,0.100,{m % 2**32}\r\n".encode()
+            for k, m in enumerate(micros)
+        ]
+        pending = iter(lines)
+        mock_serial.return_value.readline.side_effect = lambda: next(pending, b"")
+        logger = ConsoLogger(duration=1, integration="trapezoid", integration_batch=3)
+        logger.read_serial_data()
+
+        self.assertEqual(len(logger.gaps), 1)
+        self.assertEqual(logger.gaps[0][0], 7)
+        self.assertAlmostEqual(logger.gaps[0][1], 10.0)
+        self.assertAlmostEqual(logger.integrated_duration_s, 4.5)
+        # Trapèzes sur les segments avant et après le trou
+        expected = sum((logger.powers[k] + logger.powers[k + 1]) / 2 for k in range(7))
+        expected += sum((logger.powers[k] + logger.powers[k + 1]) / 2 for k in (8, 9))
+        self.assertAlmostEqual(logger.total_energy_mWh_raw, expected * 0.5 / 3600)
+        self.assertEqual(len(logger.timestamps), 11)
+        self.assertAlmostEqual(
+            (logger.timestamps[-1] - logger.timestamps[0]).total_seconds(), 14.5
+        )
+        self.assertIs(type(logger.gaps[0][1]), float)
+
+        # Les trous sont signalés dans les alertes du fichier de résultats
+        report = logger.compute_report()
+        self.assertEqual(report["gap_count"], 1)
+        self.assertAlmostEqual(report["gap_total_s"], 10.0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger.csv_file = os.path.join(tmpdir, "mesures.csv")
+            logger.wh_raw = logger.wh_kal = logger.mah_raw = logger.mah_kal = 0
+            logger.battery_raw = logger.battery_kal = 0
+            logger.compute_statistics()
+            logger.save_results()
+            with open(
+                logger.csv_file.replace(".csv", "_results.txt"), encoding="utf-8"
+            ) as f:
+                results = f.read()
+        self.assertIn("ALERTES", results)
+        self.assertIn("Trous d'acquisition: 1 (10.0s", results)
+
+    @patch("serial.Serial")
+    def test_current_peaks_between_lines(self, mock_serial):
+        lines = [
+            b"5.000,100.000,500.000,5.000,0.100,1000,99.000,101.000\r\n",
+            b"5.000,100.000,500.000,5.000,0.100,2001000,98.000,750.000\r\n",
+        ]
+        pending = iter(lines)
+        mock_serial.return_value.readline.side_effect = lambda: next(pending, b"")
+        logger = ConsoLogger(duration=1)
+        logger.read_serial_data()
+        stats = logger.compute_report()["stats"]["current"]["raw"]
+        # Le pic lu entre deux lignes envoyées apparaît dans les statistiques
+        self.assertEqual(stats["max"], 750.0)
+        self.assertEqual(stats["min"], 98.0)
+
+    def test_csv_index_with_non_csv_name(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger = self._logger_with_samples(tmpdir)
+            logger.csv_file = os.path.join(tmpdir, "mesures.txt")
+            logger.export_csv()
+            self.assertEqual(
+                logger._index_file(), os.path.join(tmpdir, "mesures.idx.json")
+            )
+            # Le CSV n'est pas écrasé par l'index
+            with open(logger.csv_file, encoding="utf-8") as f:
+                self.assertTrue(f.readline().startswith("timestamp,"))
+            data = logger.load_csv_range(logger.timestamps[0], logger.timestamps[9])
+            self.assertEqual(data["power_mW"], logger.powers[:10])
+
+    def test_csv_index_rebuilt_when_csv_rewritten_same_size(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger = self._logger_with_samples(tmpdir)
+            logger.export_csv()
+            with open(logger.csv_file, encoding="utf-8") as f:
+                content = f.read()
+            # Nouvelle capture de même taille sous le même nom
+            with open(logger.csv_file, "w", encoding="utf-8", newline="") as f:
+                f.write(content.replace(",500.0,", ",600.0,"))
+            stat = os.stat(logger.csv_file)
+            os.utime(logger.csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            blocks = logger.load_csv_index()
+            self.assertEqual(blocks[0]["power"]["max"], 600.0)
+
+    @patch("serial.Serial")
+    def test_csv_index_matches_trapezoid_totals(self, mock_serial):
+        # 12 échantillons à 0,5 s avec un trou de 20 s au milieu
+        micros = [k * 500000 for k in range(6)]
+        micros += [micros[-1] + 20000000 + k * 500000 for k in range(6)]
+        lines = [
+            f"5.000,{100 + 3 * k},{500 + 7 * k},5.000,0.100,{m}\r\n".encode()
+            for k, m in enumerate(micros)
+        ]
+        pending = iter(lines)
+        mock_serial.return_value.readline.side_effect = lambda: next(pending, b"")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger = ConsoLogger(
+                duration=1,
+                csv_file=os.path.join(tmpdir, "mesures.csv"),
+                integration="trapezoid",
+                index_block_size=4,
+            )
+            logger.read_serial_data()
+            logger.export_csv()
+            start, end = logger.timestamps[0], logger.timestamps[-1]
+            energy, charge = logger.energy_between(start, end)
+            self.assertAlmostEqual(energy, logger.total_energy_mWh_raw)
+            self.assertAlmostEqual(charge, logger.total_charge_mAh_raw)
+
+            # Même résultat avec un index reconstruit depuis le CSV
+            os.remove(logger._index_file())
+            energy, charge = logger.energy_between(start, end)
+            self.assertAlmostEqual(energy, logger.total_energy_mWh_raw)
+            self.assertAlmostEqual(charge, logger.total_charge_mAh_raw)
+
+    def test_gap_threshold_follows_adaptive_period(self):
+        logger = ConsoLogger(
+            integration="trapezoid", device_config={"adaptive": (50, 10000, 5)}
+        )
+        self.assertEqual(logger._gap_threshold_s(), 20.0)
+        # Intervalles de repos de 6,4 s et 10 s : intégrés, pas des trous
+        for k, t in enumerate([0.0, 6.4, 16.4, 26.4]):
+            logger.ticks_ns.append(int(t * 1e9))
+            for name in ("powers", "powers_kalman"):
+                getattr(logger, name).append(500.0)
+            for name in ("currents", "currents_kalman"):
+                getattr(logger, name).append(100.0)
+        logger._integrate_batch()
+        self.assertEqual(logger.gaps, [])
+        self.assertAlmostEqual(logger.integrated_duration_s, 26.4)
+        self.assertAlmostEqual(logger.total_charge_mAh_raw, 100.0 * 26.4 / 3600)
+
+    @patch("serial.Serial")
+    def test_device_restart_is_not_a_wrap(self, mock_serial):
+        # Compteur à ~50 min puis redémarrage de la carte (micros() repart de 0)
+        micros = [3000000000 + k * 500000 for k in range(6)]
+        micros += [100000 + k * 500000 for k in range(4)]
+        lines = [f"5.000,100.000,500.000,5.000,0.100,{m}\r\n".encode() for m in micros]
+        pending = iter(lines)
+        mock_serial.return_value.readline.side_effect = lambda: next(pending, b"")
+        logger = ConsoLogger(duration=1, integration="trapezoid")
+        logger.read_serial_data()
+
+        self.assertEqual(len(logger.gaps), 1)
+        self.assertEqual(logger.gaps[0][0], 5)
+        self.assertAlmostEqual(logger.integrated_duration_s, 2.5 + 1.5)
+        # Recalage sur l'horloge hôte, juste au-delà du seuil : pas de saut de 71 min
+        span = (logger.timestamps[-1] - logger.timestamps[0]).total_seconds()
+        self.assertLess(span, 2.5 + 1.5 + logger._gap_threshold_s() + 1)
+        self.assertAlmostEqual(
+            (logger.timestamps[5] - logger.timestamps[0]).total_seconds(), 2.5
+        )